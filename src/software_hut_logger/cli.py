@@ -10,6 +10,13 @@ from typing import Optional
 import psutil
 
 
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return number
+
+
 def create_parser():
     parser = argparse.ArgumentParser(description='Software Hut Logger CLI')
     subparsers = parser.add_subparsers(dest='command', required=True)
@@ -32,6 +39,25 @@ def create_parser():
     upload_run_parser.add_argument('--upload-port', '--upload_port', type=int, default=8000,
                                  help='Port number of receiving server')
 
+    # analyze command
+    analyze_parser = subparsers.add_parser('analyze', help='Compare metrics across run directories')
+    analyze_parser.add_argument('--runs-dir', '--runs_dir', dest='runs_dir', type=str, default='runs',
+                                help='Path to directory containing run directories')
+    analyze_parser.add_argument('--metric', type=str, default=None,
+                                help='Metric to compare. Defaults to eval_loss, or loss with --at-step')
+    analyze_parser.add_argument('--mode', type=str, choices=['min', 'max'], default='min',
+                                help='Whether the best value of the metric is the lowest or highest')
+    analyze_parser.add_argument('--at-step', '--at_step', dest='at_steps', type=int, nargs='+', default=None,
+                                help='Show the value of the metric at these steps instead of a summary')
+    analyze_parser.add_argument('--format', dest='output_format', type=str, choices=['table', 'csv', 'json'],
+                                default='table', help='Output format')
+    analyze_parser.add_argument('--cache-dir', '--cache_dir', dest='cache_dir', type=str, default=None,
+                                help='Directory to cache parsed run indexes in')
+    analyze_parser.add_argument('--no-cache', '--no_cache', dest='no_cache', action='store_true',
+                                help='Parse every run without reading or writing the cache')
+    analyze_parser.add_argument('--workers', type=positive_int, default=None,
+                                help='Number of worker processes used to parse runs')
+
     # Server command
     server_parser = subparsers.add_parser('server', help='Run server operations')
     server_subparsers = server_parser.add_subparsers(dest='server_command', required=True)
@@ -141,6 +167,28 @@ def handle_test_log_command(args):
     upload_run(args.run_dir, args.api_key, args.upload_url, args.upload_port)
 
 
+def handle_analyze_command(args):
+    from .shl_analyze import DEFAULT_CACHE_DIR, analyze, write_rows
+
+    if not Path(args.runs_dir).is_dir():
+        print(f"Runs directory not found: {args.runs_dir}")
+        sys.exit(1)
+
+    cache_dir = None if args.no_cache else (args.cache_dir or DEFAULT_CACHE_DIR)
+    rows = analyze(
+        args.runs_dir,
+        metric=args.metric,
+        mode=args.mode,
+        at_steps=args.at_steps,
+        cache_dir=cache_dir,
+        workers=args.workers,
+    )
+    if not rows:
+        print(f"No runs found in {args.runs_dir}")
+        return
+    write_rows(rows, args.output_format)
+
+
 def start_server(args):
     existing_pid = read_pid_file(args.pid_file)
     if existing_pid and is_process_running(existing_pid):
@@ -232,6 +280,8 @@ def main():
         handle_build_example_dataset_command(args)
     elif args.command == 'upload-run':
         handle_test_log_command(args)
+    elif args.command == 'analyze':
+        handle_analyze_command(args)
     elif args.command == 'server':
         if args.server_command == 'start':
             start_server(args)
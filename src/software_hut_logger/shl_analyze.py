@@ -0,0 +1,297 @@
+from array import array
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import csv
+from datetime import datetime
+import hashlib
+import json
+import logging
+import math
+import os
+from pathlib import Path
+import pickle
+import sys
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get("SH_LOGGING_LEVEL", "WARNING"))
+
+
+METRIC_FILE_NAME = "metrics.jsonl"
+DEFAULT_CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "software-hut-logger" / "analyze"
+# Bump whenever the layout of the cached index changes so stale indexes are rebuilt
+INDEX_VERSION = 2
+
+
+def find_runs(runs_dir):
+    """Returns every directory under `runs_dir` containing a metrics file, sorted by path."""
+    runs_dir = Path(runs_dir)
+    return sorted(metric_file.parent for metric_file in runs_dir.rglob(METRIC_FILE_NAME))
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def build_index(run_dir):
+    """Parses a run's metrics file into a sparse columnar index.
+
+    Every scalar metric is stored as a pair of `array('d')` columns holding the `global_step` and value of each record
+    it was logged in. Records without a `global_step` take the step of the record before them (NaN if there is none).
+    If the step goes backwards, as when a run is resumed from a checkpoint into the same directory, entries logged
+    after the resumed step are dropped so that steps never decrease. Timestamps are stored as POSIX seconds and
+    list-valued metrics are dropped.
+    """
+    metric_file = Path(run_dir) / METRIC_FILE_NAME
+    stat = metric_file.stat()
+    series = {}
+    num_records = 0
+    step = math.nan
+
+    with open(metric_file, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                record = None
+            if not isinstance(record, dict):
+                logger.warning(f"Skipping malformed line in {metric_file}")
+                continue
+
+            if isinstance(timestamp := record.get("timestamp"), str):
+                try:
+                    record["timestamp"] = datetime.fromisoformat(timestamp).timestamp()
+                except ValueError:
+                    logger.warning(f"Dropping unparseable timestamp {timestamp!r} in {metric_file}")
+                    del record["timestamp"]
+
+            if _is_number(record_step := record.get("global_step")):
+                if record_step < step:
+                    for steps, values in series.values():
+                        while steps and steps[-1] > record_step:
+                            steps.pop()
+                            values.pop()
+                step = float(record_step)
+
+            for k, v in record.items():
+                if not _is_number(v):
+                    continue
+                if (columns := series.get(k)) is None:
+                    columns = series[k] = (array("d"), array("d"))
+                columns[0].append(step)
+                columns[1].append(v)
+
+            num_records += 1
+
+    return {
+        "version": INDEX_VERSION,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "num_records": num_records,
+        "series": series,
+    }
+
+
+def _cache_path(cache_dir, run_dir):
+    key = hashlib.sha1(str(Path(run_dir).resolve()).encode()).hexdigest()
+    return Path(cache_dir) / f"{key}.pkl"
+
+
+def _load_cached_index(run_dir, cache_dir):
+    """Returns the cached index for `run_dir`, or None if it is missing or the metrics file has changed since."""
+    try:
+        stat = (Path(run_dir) / METRIC_FILE_NAME).stat()
+        with open(_cache_path(cache_dir, run_dir), "rb") as f:
+            index = pickle.load(f)
+    except Exception:
+        # The cache is disposable, so anything unreadable is simply rebuilt
+        return None
+
+    if (not isinstance(index, dict)
+            or index.get("version") != INDEX_VERSION
+            or index.get("size") != stat.st_size
+            or index.get("mtime_ns") != stat.st_mtime_ns):
+        return None
+    return index
+
+
+def _build_and_cache_index(run_dir, cache_dir):
+    index = build_index(run_dir)
+    if cache_dir is not None:
+        cache_file = _cache_path(cache_dir, run_dir)
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, "wb") as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    return index
+
+
+def load_indexes(run_dirs, cache_dir=DEFAULT_CACHE_DIR, workers=None):
+    """Loads the index of every run, reusing cached indexes and rebuilding stale ones in parallel.
+
+    Args:
+        run_dirs: Run directories to load.
+        cache_dir: Directory to cache indexes in. If None, every run is parsed and nothing is cached.
+        workers: Maximum number of worker processes used to parse stale runs.
+    """
+    run_dirs = list(run_dirs)
+    if cache_dir is not None:
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            indexes = list(executor.map(lambda run_dir: _load_cached_index(run_dir, cache_dir), run_dirs))
+    else:
+        indexes = [None] * len(run_dirs)
+
+    stale = [i for i, index in enumerate(indexes) if index is None]
+    logger.debug(f"Loaded {len(run_dirs) - len(stale)} cached indexes, rebuilding {len(stale)}")
+
+    # Parsing is CPU bound so only pay for worker processes when there is enough work to share out
+    if len(stale) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            rebuilt = executor.map(_build_and_cache_index, [run_dirs[i] for i in stale], [cache_dir] * len(stale))
+            for i, index in zip(stale, rebuilt):
+                indexes[i] = index
+    elif stale:
+        indexes[stale[0]] = _build_and_cache_index(run_dirs[stale[0]], cache_dir)
+
+    return dict(zip(run_dirs, indexes))
+
+
+def _as_step(step):
+    return None if step is None or math.isnan(step) else int(step)
+
+
+def _last(index, key):
+    """Returns (step, value) for the last record in which `key` was logged."""
+    if not (columns := index["series"].get(key)) or not columns[0]:
+        return None, None
+    return columns[0][-1], columns[1][-1]
+
+
+def _value_at(index, key, step):
+    """Returns the value of `key` from the last record logged at or before `step`."""
+    if not (columns := index["series"].get(key)):
+        return None
+    steps, values = columns
+    i = bisect_right(steps, step)
+    return values[i - 1] if i else None
+
+
+def _best(index, key, mode="min"):
+    """Returns (step, value) for the lowest or highest value of `key`, ignoring NaN."""
+    if not (columns := index["series"].get(key)) or not columns[0]:
+        return None, None
+    steps, values = columns
+    select = min if mode == "min" else max
+    # Summing runs in C and is only NaN if a value is, so the slow filtered path is only taken when needed
+    if math.isnan(sum(values)):
+        best = select((v for v in values if not math.isnan(v)), default=None)
+        if best is None:
+            return None, None
+    else:
+        best = select(values)
+    return steps[values.index(best)], best
+
+
+def _final_loss(index):
+    """Returns the last training loss, preferring `loss_last` over the window mean of aggregated records."""
+    loss_step, loss = _last(index, "loss")
+    last_step, last_loss = _last(index, "loss_last")
+    if last_loss is not None and (loss_step is None or not last_step < loss_step):
+        return last_loss
+    return loss
+
+
+def _steps_per_second(index):
+    """Uses the trainer's own figure from the final summary if present, otherwise estimates it from timestamps."""
+    if (value := _last(index, "train_steps_per_second")[1]) is not None:
+        return value
+
+    if not (columns := index["series"].get("timestamp")) or len(columns[0]) < 2:
+        return None
+    steps, timestamps = columns
+    elapsed = timestamps[-1] - timestamps[0]
+    steps_taken = steps[-1] - steps[0]
+    return steps_taken / elapsed if elapsed > 0 and not math.isnan(steps_taken) else None
+
+
+def summarise_run(index, metric="eval_loss", mode="min"):
+    """Summarises a single run: the best value of `metric`, training speed and final training loss."""
+    best_step, best_value = _best(index, metric, mode)
+    return {
+        "records": index["num_records"],
+        "last_step": _as_step(_last(index, "global_step")[1]),
+        f"best_{metric}": best_value,
+        "best_step": _as_step(best_step),
+        "final_loss": _final_loss(index),
+        "steps_per_second": _steps_per_second(index),
+        "train_runtime": _last(index, "train_runtime")[1],
+    }
+
+
+def metric_at_steps(index, metric, steps):
+    """Returns the most recent value of `metric` logged at or before each of `steps`.
+
+    For runs written with log aggregation, values of training metrics are the mean over the aggregation window that
+    ends at or before each step.
+    """
+    return {str(step): _value_at(index, metric, step) for step in steps}
+
+
+def analyze(runs_dir, metric=None, mode="min", at_steps=None, cache_dir=DEFAULT_CACHE_DIR, workers=None):
+    """Builds one row per run under `runs_dir`.
+
+    If `at_steps` is given, each row holds the value of `metric` (default `loss`) at those steps. Otherwise each row
+    summarises the run, with runs sorted by their best value of `metric` (default `eval_loss`).
+    """
+    runs_dir = Path(runs_dir)
+    indexes = load_indexes(find_runs(runs_dir), cache_dir=cache_dir, workers=workers)
+
+    rows = []
+    for run_dir, index in indexes.items():
+        row = {"run": str(run_dir.relative_to(runs_dir)) if run_dir != runs_dir else run_dir.name}
+        if at_steps:
+            row.update(metric_at_steps(index, metric or "loss", at_steps))
+        else:
+            row.update(summarise_run(index, metric or "eval_loss", mode))
+        rows.append(row)
+
+    if not at_steps:
+        best_key = f"best_{metric or 'eval_loss'}"
+        sign = 1 if mode == "min" else -1
+        rows.sort(key=lambda row: (row[best_key] is None, sign * (row[best_key] or 0)))
+    return rows
+
+
+def _format_value(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    return str(value)
+
+
+def write_rows(rows, output_format="table", file=sys.stdout):
+    if output_format == "json":
+        json.dump(rows, file, indent=4)
+        file.write("\n")
+        return
+
+    if not rows:
+        return
+    columns = list(rows[0].keys())
+
+    if output_format == "csv":
+        writer = csv.DictWriter(file, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+        return
+
+    cells = [columns] + [[_format_value(row[c]) for c in columns] for row in rows]
+    widths = [max(len(line[i]) for line in cells) for i in range(len(columns))]
+    for i, line in enumerate(cells):
+        file.write("  ".join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip() + "\n")
+        if i == 0:
+            file.write("  ".join("-" * width for width in widths) + "\n")
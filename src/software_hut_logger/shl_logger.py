@@ -1,7 +1,10 @@
 import os
+from array import array
+import atexit
 from datetime import datetime
 import logging
 from pathlib import Path
+import time
 import torch
 from transformers import TrainerCallback
 import json
@@ -15,12 +18,41 @@ logger.setLevel(os.environ.get("SH_LOGGING_LEVEL", "WARNING"))
 
 RUNS_BASE_DIR = Path.cwd() / Path("runs")
 
+# Keys which are carried through an aggregated record as their latest value rather than summarised
+STEP_KEYS = ("global_step", "epoch")
+# Logs containing any of these keys (or prefixes) are written unchanged, even when aggregating
+PASSTHROUGH_KEYS = ("train_runtime",)
+PASSTHROUGH_PREFIXES = ("eval_", "test_", "predict_")
+
+# Layout of the per-key running statistics buffer
+_COUNT, _MEAN, _MIN, _MAX, _LAST = range(5)
+
+
+def _aggregation_option(value, name, env_name, cast):
+    """Returns `value`, falling back to `env_name` only when it was not passed. 0 disables the option."""
+    if value is None and (env_value := os.environ.get(env_name)):
+        value = cast(env_value)
+    if value is not None and not value >= 0:
+        raise ValueError(f"{name} must be a non-negative number, got {value}")
+    return value or None
+
 
 class SoftwareHutLogger(TrainerCallback):
     """Callback class for the huggingface trainer to log training and evaluation metrics in the required format
     for Software Hut teams.   
+
+    By default every log is written as its own line in `metrics.jsonl`. Setting any of the aggregation options
+    accumulates training logs into per-key running statistics (count, mean, min, max, last) and writes one
+    record per window instead. Evaluation logs and the final training summary are always written unchanged.
+
+    Args:
+        aggregate_steps: Emit one record every `aggregate_steps` global steps. Defaults to `SH_AGGREGATE_STEPS`.
+            For all aggregation options, passing 0 disables the option even if its environment variable is set.
+        aggregate_seconds: Emit one record every `aggregate_seconds` seconds. Defaults to `SH_AGGREGATE_SECONDS`.
+        max_records_per_second: Upper bound on the rate of written records. Logs arriving faster than this are
+            aggregated until the rate drops back below the target. Defaults to `SH_MAX_RECORDS_PER_SECOND`.
     """
-    def __init__(self):
+    def __init__(self, aggregate_steps=None, aggregate_seconds=None, max_records_per_second=None):
         self._initialized = False
         self._project_name = ""
         self._experiment_name = ""
@@ -28,6 +60,23 @@ class SoftwareHutLogger(TrainerCallback):
         self._metric_file = ""
         self._run_metadata_file = ""
 
+        self._aggregate_steps = _aggregation_option(aggregate_steps, "aggregate_steps", "SH_AGGREGATE_STEPS", int)
+        self._aggregate_seconds = _aggregation_option(
+            aggregate_seconds, "aggregate_seconds", "SH_AGGREGATE_SECONDS", float
+        )
+        max_records_per_second = _aggregation_option(
+            max_records_per_second, "max_records_per_second", "SH_MAX_RECORDS_PER_SECOND", float
+        )
+        self._min_record_interval = 1 / max_records_per_second if max_records_per_second else None
+        self._aggregating = any((self._aggregate_steps, self._aggregate_seconds, self._min_record_interval))
+
+        self._aggregates = {}
+        self._pending_logs = None
+        self._window_count = 0
+        self._window_start_step = None
+        self._last_record_step = 0
+        self._last_record_time = time.monotonic()
+
     def setup(self, args, state, model):
         self._initialized = True
 
@@ -61,11 +110,19 @@ class SoftwareHutLogger(TrainerCallback):
         self._run_metadata_file = self._run_dir / "run_metadata.json"
         with open(self._run_metadata_file, "w") as f:
             json.dump(args.to_dict() | {"training_state": "failed"}, f, indent=4)
+
+        # Make sure the open aggregation window is written if training crashes or is interrupted
+        if self._aggregating:
+            atexit.register(self._flush_aggregates)
         
     def on_train_begin(self, args, state, control, model=None, **kwargs):
         if not self._initialized:
             self.setup(args, state, model)
 
+        # Start the first window from where training actually begins, e.g. after resuming or a slow model load
+        self._last_record_step = state.global_step
+        self._last_record_time = time.monotonic()
+
     def on_log(self, args, state, control, model=None, logs=None, **kwargs):
         if not self._initialized:
             self.setup(args, state, model)
@@ -86,14 +143,100 @@ class SoftwareHutLogger(TrainerCallback):
                 if not "global_step" in metrics:
                     metrics["global_step"] = state.global_step
 
-                with open(self._metric_file, "a") as f:
-                    f.write(json.dumps({
-                        **metrics,
-                        "timestamp": datetime.now().isoformat(),
-                    }) + "\n")
+                if not self._aggregating or self._is_passthrough(metrics):
+                    self._flush_aggregates()
+                    self._write_record(metrics)
+                else:
+                    self._accumulate(metrics)
+                    if self._window_complete(metrics["global_step"]):
+                        self._flush_aggregates()
+
+    def _write_record(self, metrics):
+        with open(self._metric_file, "a") as f:
+            f.write(json.dumps({
+                **metrics,
+                "timestamp": datetime.now().isoformat(),
+            }) + "\n")
+        self._last_record_step = metrics["global_step"]
+        self._last_record_time = time.monotonic()
+
+    @staticmethod
+    def _is_passthrough(metrics):
+        for k, v in metrics.items():
+            if k in PASSTHROUGH_KEYS or k.startswith(PASSTHROUGH_PREFIXES) or isinstance(v, list):
+                return True
+        return False
+
+    def _accumulate(self, metrics):
+        if self._window_count == 0:
+            self._window_start_step = metrics["global_step"]
+        self._window_count += 1
+        self._pending_logs = metrics
+
+        for k, v in metrics.items():
+            if k in STEP_KEYS:
+                continue
+            v = float(v)
+            if (stats := self._aggregates.get(k)) is None:
+                self._aggregates[k] = array("d", (1, v, v, v, v))
+                continue
+            stats[_COUNT] += 1
+            stats[_MEAN] += (v - stats[_MEAN]) / stats[_COUNT]
+            stats[_MIN] = min(stats[_MIN], v)
+            stats[_MAX] = max(stats[_MAX], v)
+            stats[_LAST] = v
+
+    def _window_complete(self, global_step):
+        elapsed = time.monotonic() - self._last_record_time
+        if self._min_record_interval and elapsed < self._min_record_interval:
+            return False
+        if self._aggregate_steps and global_step - self._last_record_step >= self._aggregate_steps:
+            return True
+        if self._aggregate_seconds and elapsed >= self._aggregate_seconds:
+            return True
+        return not (self._aggregate_steps or self._aggregate_seconds)
+
+    def _flush_aggregates(self):
+        if self._window_count == 0:
+            return
+
+        # A window of one log has nothing to summarise, so it is written as-is to avoid inflating the file
+        if self._window_count == 1:
+            record = {**self._pending_logs, "aggregated_logs": 1}
+        else:
+            record = {}
+            for k, stats in self._aggregates.items():
+                record[k] = stats[_MEAN]
+                record[f"{k}_min"] = stats[_MIN]
+                record[f"{k}_max"] = stats[_MAX]
+                record[f"{k}_last"] = stats[_LAST]
+                if stats[_COUNT] != self._window_count:
+                    record[f"{k}_count"] = int(stats[_COUNT])
+            record.update({k: self._pending_logs[k] for k in STEP_KEYS if k in self._pending_logs})
+            record["aggregated_logs"] = self._window_count
+            record["aggregated_from_step"] = self._window_start_step
+
+        self._write_record(record)
+        self._aggregates = {}
+        self._pending_logs = None
+        self._window_count = 0
+        self._window_start_step = None
+
+    def on_save(self, args, state, control, **kwargs):
+        # Bound what can be lost to a hard kill to the logs since the last checkpoint
+        if self._initialized and state.is_world_process_zero:
+            self._flush_aggregates()
+
+    def on_epoch_end(self, args, state, control, **kwargs):
+        if self._initialized and state.is_world_process_zero:
+            self._flush_aggregates()
 
     def on_train_end(self, args, state, control, **kwargs):
         if self._initialized and state.is_world_process_zero:
+            self._flush_aggregates()
+            if self._aggregating:
+                atexit.unregister(self._flush_aggregates)
+
             with open(self._run_metadata_file, "r+") as f:
                 run_metadata = json.load(f)
                 run_metadata["training_state"] = "successful"